@@ -5,9 +5,11 @@ from pathlib import Path
 from sqlalchemy import event
 from sqlalchemy.engine import Engine
 from functools import wraps
+import math
 import os
 import time
 import requests
+import numpy as np
 
 app = Flask(__name__, static_folder='static', template_folder='templates')
 
@@ -56,8 +58,13 @@ def set_sqlite_pragma(dbapi_connection, connection_record):  # noqa: D401
         pass
 db = SQLAlchemy(app)
 
-# Ensure lightweight schema migrations at import time (works under gunicorn)
+# Lightweight schema migrations, run at import time once models are defined
 def ensure_schema_migrations() -> None:
+    try:
+        migrate_coin_to_portfolios()
+    except Exception:
+        db.session.rollback()
+        app.logger.exception("Portfolio migration failed")
     try:
         from sqlalchemy import text
         cols = db.session.execute(text("PRAGMA table_info(coin)")).fetchall()
@@ -70,13 +77,6 @@ def ensure_schema_migrations() -> None:
         # ignore
         pass
 
-try:
-    with app.app_context():
-        db.create_all()
-        ensure_schema_migrations()
-except Exception:
-    pass
-
 
 # --------------------------- Login throttling ---------------------------
 class AdminLoginAttempt(db.Model):
@@ -109,9 +109,23 @@ except TypeError:
     except Exception:
         pass
 
+DEFAULT_PORTFOLIO_SLUG = 'default'
+
+
+class Portfolio(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    slug = db.Column(db.String(50), unique=True, nullable=False)
+    name = db.Column(db.String(100))
+    coins = db.relationship('Coin', backref='portfolio', cascade='all, delete-orphan', lazy=True)
+
+
 class Coin(db.Model):
+    # One position per coin per portfolio; the composite unique index also serves
+    # per-portfolio lookups (portfolio_id is its leading column)
+    __table_args__ = (db.UniqueConstraint('portfolio_id', 'coin_id', name='uq_coin_portfolio_coin'),)
     id = db.Column(db.Integer, primary_key=True)
-    coin_id = db.Column(db.String(50), unique=True, nullable=False)
+    portfolio_id = db.Column(db.Integer, db.ForeignKey('portfolio.id'), nullable=False)
+    coin_id = db.Column(db.String(50), index=True, nullable=False)
     # Portfolio-related fields
     buy_price = db.Column(db.Float)
     amount = db.Column(db.Float)
@@ -127,6 +141,73 @@ class Coin(db.Model):
     cexs = db.Column(db.Text)
     tags = db.Column(db.Text)
 
+
+UNLOCK_KINDS = ('cliff', 'linear', 'tranche')
+
+
+class UnlockSchedule(db.Model):
+    """Structured token unlock, keyed by CoinGecko id and shared by every portfolio holding the token.
+
+    tranche: everything at start. linear: equal steps from start to end.
+    cliff: vesting accrues linearly from start to end, but nothing is released
+    before cliff_epoch; the accrued share unlocks at the cliff, the rest linearly.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    coin_id = db.Column(db.String(50), index=True, nullable=False)
+    kind = db.Column(db.String(16), nullable=False, default='tranche')
+    label = db.Column(db.String(100))
+    amount = db.Column(db.Float, nullable=False)        # tokens released by this schedule
+    start_epoch = db.Column(db.Float, nullable=False)   # tranche date, or vesting start
+    cliff_epoch = db.Column(db.Float)                   # cliff only
+    end_epoch = db.Column(db.Float)                     # cliff/linear vesting end
+    period_days = db.Column(db.Float)                   # release step after start/cliff, default 30
+    updated_epoch = db.Column(db.Float, default=time.time, onupdate=time.time, index=True)
+
+def get_default_portfolio() -> 'Portfolio':
+    portfolio = Portfolio.query.filter_by(slug=DEFAULT_PORTFOLIO_SLUG).first()
+    if not portfolio:
+        portfolio = Portfolio(slug=DEFAULT_PORTFOLIO_SLUG, name='Default')
+        db.session.add(portfolio)
+        db.session.commit()
+    return portfolio
+
+
+def migrate_coin_to_portfolios() -> None:
+    """Rebuild a pre-portfolio coin table (global UNIQUE(coin_id)) into the portfolio-scoped layout.
+
+    SQLite can't drop a column constraint, so copy rows into a new table and swap it in.
+    Existing coins land in the default portfolio.
+    """
+    from sqlalchemy import text
+    cols = [c[1] for c in db.session.execute(text("PRAGMA table_info(coin)")).fetchall()]
+    if not cols or 'portfolio_id' in cols:
+        return
+    Portfolio.__table__.create(db.engine, checkfirst=True)
+    default_id = get_default_portfolio().id
+    copy_cols = [c.name for c in Coin.__table__.columns if c.name in cols]
+    col_list = ', '.join(copy_cols)
+    db.session.close()
+    with db.engine.begin() as conn:
+        conn.execute(text("ALTER TABLE coin RENAME TO coin_pre_portfolio"))
+        for index in Coin.__table__.indexes:
+            conn.execute(text(f"DROP INDEX IF EXISTS {index.name}"))
+        Coin.__table__.create(conn)
+        conn.execute(text(
+            f"INSERT INTO coin (portfolio_id, {col_list}) "
+            f"SELECT :pid, {col_list} FROM coin_pre_portfolio"
+        ), {'pid': default_id})
+        conn.execute(text("DROP TABLE coin_pre_portfolio"))
+
+
+# Ensure tables and lightweight migrations at import time (works under gunicorn)
+try:
+    with app.app_context():
+        db.create_all()
+        ensure_schema_migrations()
+except Exception:
+    pass
+
+
 _coin_list_cache = {
     'ids': set(),
     'last_fetch_epoch': 0.0,
@@ -144,16 +225,30 @@ def get_valid_coin_ids_set(cache_ttl_seconds: int = 3600) -> set:
             pass
     return _coin_list_cache['ids']
 
-def fetch_market_data_for_configured_coins() -> dict:
-    coins = Coin.query.all()
-    coin_ids = [c.coin_id for c in coins]
-    if not coin_ids:
-        return {}
-    try:
-        markets_data = cg.get_coins_markets(vs_currency='usd', ids=','.join(coin_ids))
-    except Exception:
-        markets_data = []
-    return {market['id']: market for market in markets_data}
+# Distinct coin ids across all portfolios. Coin writes in this process invalidate it;
+# the TTL picks up writes made by other workers.
+WATCHLIST_TTL_SECONDS = 60
+
+_watchlist_cache = {
+    'ids': [],
+    'ids_key': '',
+    'loaded_epoch': 0.0,    # 0 = invalidated
+}
+
+def get_watchlist() -> tuple[list[str], str]:
+    """Return (coin_ids, ids_key): the one list we fetch market data for."""
+    now = time.time()
+    if now - _watchlist_cache['loaded_epoch'] > WATCHLIST_TTL_SECONDS:
+        rows = db.session.query(Coin.coin_id).distinct().order_by(Coin.coin_id).all()
+        ids = [r[0] for r in rows]
+        _watchlist_cache.update({'ids': ids, 'ids_key': ','.join(ids), 'loaded_epoch': now})
+    return _watchlist_cache['ids'], _watchlist_cache['ids_key']
+
+@event.listens_for(Coin, 'after_insert')
+@event.listens_for(Coin, 'after_update')
+@event.listens_for(Coin, 'after_delete')
+def _invalidate_watchlist(mapper, connection, target):
+    _watchlist_cache['loaded_epoch'] = 0.0
 
 # Cache market data to respect free API limits
 _market_cache = {
@@ -163,31 +258,37 @@ _market_cache = {
     'ids_key': '',
 }
 
+# /coins/markets returns at most 250 rows per page
+MARKETS_PAGE_SIZE = 250
+
 def _fetch_markets_via_requests(coin_ids: list[str], timeout_seconds: int = 10) -> list[dict]:
     if not coin_ids:
         return []
     url = "https://api.coingecko.com/api/v3/coins/markets"
-    params = {
-        'vs_currency': 'usd',
-        'ids': ','.join(coin_ids),
-        'price_change_percentage': '24h,7d',
-    }
     headers = {
         'User-Agent': 'crypto-prices-dashboard/1.0 (+https://github.com/BenjaminZH1777/crypto-prices-dashboard)'
     }
-    resp = requests.get(url, params=params, headers=headers, timeout=timeout_seconds)
-    resp.raise_for_status()
-    return resp.json() or []
+    markets = []
+    for i in range(0, len(coin_ids), MARKETS_PAGE_SIZE):
+        params = {
+            'vs_currency': 'usd',
+            'ids': ','.join(coin_ids[i:i + MARKETS_PAGE_SIZE]),
+            'per_page': MARKETS_PAGE_SIZE,
+            'price_change_percentage': '24h,7d',
+        }
+        resp = requests.get(url, params=params, headers=headers, timeout=timeout_seconds)
+        resp.raise_for_status()
+        markets.extend(resp.json() or [])
+    return markets
 
 def get_cached_market_data(ttl_seconds: int = 300) -> tuple[dict, float, int]:
     """Return (data_dict, last_fetch_epoch, ttl) with simple in-process cache.
 
+    - One fetch covers the union watchlist of every portfolio
     - Re-fetch when ttl expired or configured coin ids changed
     - On fetch error, keep previous cache and timestamps
     """
-    coins = Coin.query.all()
-    coin_ids = [c.coin_id for c in coins]
-    ids_key = ','.join(sorted(coin_ids))
+    coin_ids, ids_key = get_watchlist()
     now = time.time()
 
     should_refresh = (
@@ -216,6 +317,557 @@ def get_cached_market_data(ttl_seconds: int = 300) -> tuple[dict, float, int]:
             _market_cache['ids_key'] = ids_key
     return _market_cache['data'], _market_cache['last_fetch_epoch'], ttl_seconds
 
+
+# --------------------------- Market chart cache ---------------------------
+# Per-coin price series from /coins/{id}/market_chart, stored as uncompressed
+# numpy arrays under instance/market_chart/<coin_id>.npz (see compact_chart_arrays
+# for the retained resolution):
+#   ts          int64   ms epoch, strictly increasing
+#   prices      float64 USD price
+#   caps        float64 market cap
+#   volumes     float64 rolling 24h volume
+#   daily_day   int64   UTC day number (ms epoch // 1 day) with at least one price
+#   daily_close float64 last price of that day
+# The daily columns let risk calculations read one small member per coin.
+CHART_DIR = DB_DIR / 'market_chart'
+CHART_DIR.mkdir(exist_ok=True)
+CHART_SERIES = ('prices', 'caps', 'volumes')
+CHART_INITIAL_DAYS = int(os.environ.get('CHART_INITIAL_DAYS', '365'))
+# CoinGecko returns daily points for ranges over 90 days and hourly points up to 90 days,
+# so the initial fill also fetches this many recent days to get hourly resolution there.
+CHART_HOURLY_DAYS = 90
+CHART_REFRESH_SECONDS = int(os.environ.get('CHART_REFRESH_SECONDS', '300'))
+# Incremental /range refreshes come back at ~5-minute resolution; keep those only for
+# this many recent days, then hourly up to CHART_HOURLY_DAYS and daily beyond that.
+CHART_FINE_DAYS = int(os.environ.get('CHART_FINE_DAYS', '2'))
+
+# coin_id -> {'mtime': float, 'checked_epoch': float, 'arrays': dict}
+_chart_cache: dict = {}
+# coin_id -> {'mtime': float, 'day': np.ndarray, 'close': np.ndarray}
+_daily_close_cache: dict = {}
+
+OHLC_INTERVALS = {'m': 60_000, 'h': 3_600_000, 'd': 86_400_000, 'w': 7 * 86_400_000}
+OHLC_MAX_INTERVAL_MS = 53 * OHLC_INTERVALS['w']
+
+
+def _chart_path(coin_id: str) -> Path:
+    safe_id = ''.join(ch for ch in coin_id if ch.isalnum() or ch in '-_.')
+    return CHART_DIR / f'{safe_id}.npz'
+
+
+def _empty_chart_arrays() -> dict:
+    arrays = {'ts': np.empty(0, dtype=np.int64)}
+    for key in CHART_SERIES:
+        arrays[key] = np.empty(0, dtype=np.float64)
+    return arrays
+
+
+def _load_chart_arrays(coin_id: str) -> dict:
+    path = _chart_path(coin_id)
+    try:
+        mtime = path.stat().st_mtime
+    except OSError:
+        return _empty_chart_arrays()
+    cached = _chart_cache.get(coin_id)
+    if cached and cached['mtime'] == mtime:
+        return cached['arrays']
+    try:
+        with np.load(path) as npz:
+            arrays = {k: npz[k] for k in ('ts',) + CHART_SERIES}
+    except Exception:
+        # Corrupt or partial file: start over
+        return _empty_chart_arrays()
+    _chart_cache[coin_id] = {
+        'mtime': mtime,
+        'checked_epoch': (cached or {}).get('checked_epoch', 0.0),
+        'arrays': arrays,
+    }
+    return arrays
+
+
+def _daily_closes(ts: 'np.ndarray', prices: 'np.ndarray') -> tuple['np.ndarray', 'np.ndarray']:
+    """Return (day numbers, closes): the last non-NaN price of each UTC day."""
+    valid = ~np.isnan(prices)
+    ts, prices = ts[valid], prices[valid]
+    day = ts // OHLC_INTERVALS['d']
+    last = np.flatnonzero(np.r_[day[1:] != day[:-1], True]) if len(day) else np.empty(0, dtype=np.int64)
+    return day[last], prices[last]
+
+
+def _load_daily_closes(coin_id: str) -> tuple['np.ndarray', 'np.ndarray']:
+    """Daily closes for a coin, read from the chart file without loading the full series."""
+    path = _chart_path(coin_id)
+    try:
+        mtime = path.stat().st_mtime
+    except OSError:
+        return np.empty(0, dtype=np.int64), np.empty(0)
+    cached = _daily_close_cache.get(coin_id)
+    if cached and cached['mtime'] == mtime:
+        return cached['day'], cached['close']
+    try:
+        # npz members load lazily, so only the two small daily arrays are read
+        with np.load(path) as npz:
+            if 'daily_day' in npz.files:
+                day, close = npz['daily_day'], npz['daily_close']
+            else:
+                day, close = _daily_closes(npz['ts'], npz['prices'])
+    except Exception:
+        return np.empty(0, dtype=np.int64), np.empty(0)
+    _daily_close_cache[coin_id] = {'mtime': mtime, 'day': day, 'close': close}
+    return day, close
+
+
+def _save_chart_arrays(coin_id: str, arrays: dict) -> None:
+    path = _chart_path(coin_id)
+    day, close = _daily_closes(arrays['ts'], arrays['prices'])
+    # Write to a temp file then rename so concurrent workers never read a partial file.
+    # Uncompressed: files are small after compaction and cold reads stay cheap.
+    tmp_path = path.with_name(f'{path.stem}.{os.getpid()}.tmp.npz')
+    np.savez(tmp_path, daily_day=day, daily_close=close, **arrays)
+    os.replace(tmp_path, path)
+    mtime = path.stat().st_mtime
+    _chart_cache[coin_id] = {
+        'mtime': mtime,
+        'checked_epoch': time.time(),
+        'arrays': arrays,
+    }
+    _daily_close_cache[coin_id] = {'mtime': mtime, 'day': day, 'close': close}
+
+
+def compact_chart_arrays(arrays: dict, now_ms: int | None = None) -> dict:
+    """Downsample old points: the last sample per hour past CHART_FINE_DAYS, per day past CHART_HOURLY_DAYS."""
+    ts = arrays['ts']
+    if not len(ts):
+        return arrays
+    if now_ms is None:
+        now_ms = int(time.time() * 1000)
+    day_ms, hour_ms = OHLC_INTERVALS['d'], OHLC_INTERVALS['h']
+    age = now_ms - ts
+    resolution = np.where(age > CHART_HOURLY_DAYS * day_ms, day_ms, np.where(age > CHART_FINE_DAYS * day_ms, hour_ms, 1))
+    # ts is sorted and resolution only shrinks towards the present, so buckets are contiguous
+    bucket = ts // resolution
+    keep = np.r_[(bucket[1:] != bucket[:-1]) | (resolution[1:] != resolution[:-1]), True]
+    if keep.all():
+        return arrays
+    return {k: v[keep] for k, v in arrays.items()}
+
+
+def _fetch_market_chart_via_requests(coin_id: str, from_epoch: float | None = None, days: int | None = None, timeout_seconds: float = 10) -> dict:
+    """Fetch a market chart either by trailing `days` or from `from_epoch` until now."""
+    base = f"https://api.coingecko.com/api/v3/coins/{coin_id}/market_chart"
+    if from_epoch is not None:
+        url = base + '/range'
+        params = {'vs_currency': 'usd', 'from': int(from_epoch), 'to': int(time.time())}
+    else:
+        url = base
+        params = {'vs_currency': 'usd', 'days': days or CHART_INITIAL_DAYS}
+    headers = {
+        'User-Agent': 'crypto-prices-dashboard/1.0 (+https://github.com/BenjaminZH1777/crypto-prices-dashboard)'
+    }
+    resp = requests.get(url, params=params, headers=headers, timeout=timeout_seconds)
+    resp.raise_for_status()
+    return resp.json() or {}
+
+
+def _chart_payload_to_arrays(payload: dict) -> dict:
+    """Convert CoinGecko [[ts, value], ...] lists into aligned arrays keyed by price timestamps."""
+    prices = np.asarray(payload.get('prices') or [], dtype=np.float64).reshape(-1, 2)
+    if not len(prices):
+        return _empty_chart_arrays()
+    raw_ts = prices[:, 0].astype(np.int64)
+    # Sort and deduplicate, keeping the last value per timestamp
+    ts, first = np.unique(raw_ts[::-1], return_index=True)
+    arrays = {'ts': ts, 'prices': prices[len(raw_ts) - 1 - first, 1]}
+    for key, source in (('caps', 'market_caps'), ('volumes', 'total_volumes')):
+        pairs = np.asarray(payload.get(source) or [], dtype=np.float64).reshape(-1, 2)
+        values = np.full(len(ts), np.nan)
+        if len(pairs):
+            # Align by timestamp; CoinGecko normally returns identical stamps for all three
+            pair_ts = pairs[:, 0].astype(np.int64)
+            idx = np.minimum(np.searchsorted(ts, pair_ts), len(ts) - 1)
+            ok = ts[idx] == pair_ts
+            values[idx[ok]] = pairs[ok, 1]
+        arrays[key] = values
+    return arrays
+
+
+def get_market_chart(coin_id: str, refresh_seconds: int = CHART_REFRESH_SECONDS, timeout_seconds: float = 10) -> dict:
+    """Return cached chart arrays for a coin, filling or extending the cache as needed.
+
+    - First call fetches CHART_INITIAL_DAYS of daily history plus CHART_HOURLY_DAYS hourly
+    - Later calls (after refresh_seconds) only fetch the missing tail via /market_chart/range
+    - Saved series are compacted (compact_chart_arrays) so they stay bounded over time
+    - On fetch error or an empty answer, return whatever is cached and wait
+      refresh_seconds before asking again
+    """
+    arrays = _load_chart_arrays(coin_id)
+    now = time.time()
+    cached = _chart_cache.setdefault(coin_id, {'mtime': None, 'checked_epoch': 0.0, 'arrays': arrays})
+    if now - cached['checked_epoch'] <= refresh_seconds:
+        return arrays
+    cached['checked_epoch'] = now
+    try:
+        if len(arrays['ts']):
+            # Fetch from the last cached point so the range overlaps by one sample
+            payload = _fetch_market_chart_via_requests(coin_id, from_epoch=arrays['ts'][-1] / 1000.0, timeout_seconds=timeout_seconds)
+            fresh = _chart_payload_to_arrays(payload)
+        else:
+            fresh = _chart_payload_to_arrays(_fetch_market_chart_via_requests(coin_id, days=CHART_INITIAL_DAYS, timeout_seconds=timeout_seconds))
+            if len(fresh['ts']) and CHART_INITIAL_DAYS > CHART_HOURLY_DAYS:
+                try:
+                    hourly = _chart_payload_to_arrays(_fetch_market_chart_via_requests(coin_id, days=CHART_HOURLY_DAYS, timeout_seconds=timeout_seconds))
+                except Exception:
+                    hourly = _empty_chart_arrays()
+                if len(hourly['ts']):
+                    older = fresh['ts'] < hourly['ts'][0]
+                    fresh = {k: np.concatenate([fresh[k][older], hourly[k]]) for k in fresh}
+    except Exception:
+        return arrays
+    if not len(fresh['ts']):
+        return arrays
+    if len(arrays['ts']):
+        tail = fresh['ts'] > arrays['ts'][-1]
+        merged = {k: np.concatenate([arrays[k], fresh[k][tail]]) for k in arrays}
+    else:
+        merged = fresh
+    merged = compact_chart_arrays(merged)
+    try:
+        _save_chart_arrays(coin_id, merged)
+    except Exception:
+        app.logger.exception("Failed to write market chart cache for %s", coin_id)
+    return merged
+
+
+def parse_ohlc_interval(value: str) -> int | None:
+    """Parse intervals like '15m', '4h', '1d', '1w' (up to OHLC_MAX_INTERVAL_MS) into milliseconds."""
+    value = (value or '').strip().lower()
+    if len(value) < 2 or value[-1] not in OHLC_INTERVALS or not value[:-1].isdigit():
+        return None
+    interval_ms = int(value[:-1]) * OHLC_INTERVALS[value[-1]]
+    return interval_ms if 0 < interval_ms <= OHLC_MAX_INTERVAL_MS else None
+
+
+def resample_ohlc(ts: 'np.ndarray', prices: 'np.ndarray', interval_ms: int) -> dict:
+    """Aggregate a sorted price series into OHLC candles aligned to interval_ms boundaries."""
+    valid = ~np.isnan(prices)
+    ts, prices = ts[valid], prices[valid]
+    if not len(ts):
+        return {'ts': [], 'open': [], 'high': [], 'low': [], 'close': []}
+    buckets = ts - ts % interval_ms
+    # ts is sorted so buckets are too; each candle starts where the bucket changes
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], len(ts)] - 1
+    return {
+        'ts': buckets[starts].tolist(),
+        'open': prices[starts].tolist(),
+        'high': np.maximum.reduceat(prices, starts).tolist(),
+        'low': np.minimum.reduceat(prices, starts).tolist(),
+        'close': prices[ends].tolist(),
+    }
+
+
+# --------------------------- Portfolio risk ---------------------------
+DAY_MS = OHLC_INTERVALS['d']
+# Wall-clock budget for chart fetches in one risk request, well inside gunicorn's
+# 30s worker timeout; coins not reached are filled on later requests (or via /api/ohlc).
+RISK_FETCH_BUDGET_SECONDS = float(os.environ.get('RISK_FETCH_BUDGET_SECONDS', '8'))
+
+# portfolio slug (None = whole book) -> {
+#     'key': _risk_cache_key(...),
+#     'result': JSON-ready payload without the correlation matrix,
+#     'correlation': np.ndarray, serialized only when asked for,
+#     'bodies': {include_corr: (body bytes, etag)},
+# }
+_risk_cache = {}
+
+
+def build_daily_price_matrix(coin_ids: list[str], days: int, fetch_budget_seconds: float = RISK_FETCH_BUDGET_SECONDS) -> tuple['np.ndarray', 'np.ndarray', list[str]]:
+    """Return (day_ms, prices[T, N], missing_ids) of daily closes for coin_ids.
+
+    Stale or missing charts are fetched until fetch_budget_seconds runs out.
+    Gaps are forward-filled; days before a coin's first cached point stay NaN.
+    """
+    end_day = int(time.time() * 1000) // DAY_MS
+    start_day = end_day - days
+    day_ms = np.arange(start_day, end_day + 1, dtype=np.int64) * DAY_MS
+    prices = np.full((len(day_ms), len(coin_ids)), np.nan)
+    missing = []
+    deadline = time.monotonic() + fetch_budget_seconds
+    for j, coin_id in enumerate(coin_ids):
+        # Only the persisted daily closes are read; full series load just for a refresh
+        day, close = _load_daily_closes(coin_id)
+        remaining = deadline - time.monotonic()
+        if remaining >= 1.0 and (not len(day) or day[-1] < end_day - 1):
+            # An initial fill makes two requests, so give each half of what is left
+            get_market_chart(coin_id, timeout_seconds=min(10.0, remaining / 2))
+            day, close = _load_daily_closes(coin_id)
+        if not len(day):
+            missing.append(coin_id)
+            continue
+        keep = day >= start_day
+        prices[day[keep] - start_day, j] = close[keep]
+    # Forward-fill along time: carry the index of the last valid row downwards
+    valid = ~np.isnan(prices)
+    idx = np.where(valid, np.arange(len(day_ms))[:, None], 0)
+    np.maximum.accumulate(idx, axis=0, out=idx)
+    filled = prices[idx, np.arange(len(coin_ids))]
+    # Rows before the first valid value picked index 0, which may be NaN or a later coin's value
+    filled[np.cumsum(valid, axis=0) == 0] = np.nan
+    return day_ms, filled, missing
+
+
+def compute_risk_metrics(prices: 'np.ndarray', amounts: 'np.ndarray', window: int = 30, confidence: float = 0.95) -> dict:
+    """Batched risk metrics for a [T, N] daily price matrix and per-coin holdings.
+
+    Per coin: annualized rolling volatility (latest window), max drawdown,
+    historical and parametric 1-day VaR. Portfolio: the same on returns of
+    the current holdings, plus the pairwise-complete correlation matrix.
+    Portfolio metrics are None (and the volatility series empty) when nothing
+    held has a price, rather than reading as zero risk.
+    """
+    from statistics import NormalDist
+    annualize = np.sqrt(365.0)
+    z = NormalDist().inv_cdf(1.0 - confidence)
+
+    returns = prices[1:] / prices[:-1] - 1.0          # [T-1, N], NaN where either side missing
+    mask = ~np.isnan(returns)
+    r0 = np.where(mask, returns, 0.0)
+    m = mask.astype(np.float64)
+
+    # Rolling volatility via windowed cumulative sums
+    def _window_sum(a):
+        c = np.cumsum(a, axis=0)
+        c[window:] = c[window:] - c[:-window]
+        return c[window - 1:]
+    n_w = _window_sum(m)
+    s1_w = _window_sum(r0)
+    s2_w = _window_sum(r0 * r0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        var_w = (s2_w - s1_w * s1_w / n_w) / (n_w - 1)
+        rolling_vol = np.sqrt(np.where(n_w >= 2, np.maximum(var_w, 0.0), np.nan)) * annualize
+
+    # Pairwise-complete correlation with matrix products
+    with np.errstate(invalid='ignore', divide='ignore'):
+        n_ij = m.T @ m
+        sx = r0.T @ m                  # sum of x_i over rows where j also present
+        sxx = (r0 * r0).T @ m
+        sxy = r0.T @ r0
+        cov = sxy - sx * sx.T / n_ij
+        var_i = sxx - sx * sx / n_ij
+        corr = cov / np.sqrt(var_i * var_i.T)
+        corr[n_ij < 3] = np.nan
+    np.clip(corr, -1.0, 1.0, out=corr)
+
+    # Max drawdown from running peaks (NaN-aware)
+    peaks = np.fmax.accumulate(prices, axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        drawdowns = prices / peaks - 1.0
+    has_data = mask.any(axis=0)
+    max_dd = np.where(has_data, np.min(np.where(np.isnan(drawdowns), 0.0, drawdowns), axis=0), np.nan)
+
+    # Per-coin 1-day VaR as a positive loss fraction; all-NaN columns are zeroed
+    # to keep nanquantile quiet, then blanked afterwards
+    safe_returns = np.where(has_data, returns, 0.0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        hist_var = -np.nanquantile(safe_returns, 1.0 - confidence, axis=0)
+        mu = np.nanmean(safe_returns, axis=0)
+        sigma = np.nanstd(safe_returns, axis=0, ddof=1)
+    param_var = -(mu + z * sigma)
+    hist_var[~has_data] = np.nan
+    param_var[~has_data] = np.nan
+
+    # Portfolio: hold today's positions through the history (missing returns count as flat)
+    last_prices = prices[-1]
+    values = np.where(np.isnan(last_prices), 0.0, last_prices) * amounts
+    total_value = float(values.sum())
+    weights = values / total_value if total_value > 0 else np.zeros_like(values)
+    port_returns = r0 @ weights
+    equity = np.cumprod(1.0 + port_returns)
+    port_dd = float(np.min(equity / np.maximum.accumulate(equity) - 1.0)) if len(equity) else None
+    port_roll = _window_sum(port_returns[:, None])[:, 0]
+    port_roll2 = _window_sum((port_returns * port_returns)[:, None])[:, 0]
+    port_vol = np.sqrt(np.maximum((port_roll2 - port_roll * port_roll / window) / (window - 1), 0.0)) * annualize
+    if total_value <= 0:
+        port_dd = None
+        port_vol = np.empty(0)
+    if total_value > 0 and len(port_returns) >= 2:
+        p_hist = float(-np.quantile(port_returns, 1.0 - confidence))
+        p_param = float(-(port_returns.mean() + z * port_returns.std(ddof=1)))
+    else:
+        p_hist = p_param = None
+
+    return {
+        'coins': {
+            'volatility': rolling_vol[-1] if len(rolling_vol) else np.full(prices.shape[1], np.nan),
+            'max_drawdown': max_dd,
+            'var_historical': hist_var,
+            'var_parametric': param_var,
+            'value': values,
+        },
+        'correlation': corr,
+        'portfolio': {
+            'value': total_value,
+            'volatility': float(port_vol[-1]) if len(port_vol) else None,
+            'volatility_series': port_vol,
+            'max_drawdown': port_dd,
+            'var_historical': p_hist,
+            'var_parametric': p_param,
+            'var_historical_usd': p_hist * total_value if p_hist is not None else None,
+            'var_parametric_usd': p_param * total_value if p_param is not None else None,
+        },
+    }
+
+
+def _nan_to_none(values) -> list:
+    """JSON-safe list: NaN/inf become null."""
+    arr = np.asarray(values, dtype=np.float64)
+    out = arr.astype(object)
+    out[~np.isfinite(arr)] = None
+    return out.tolist()
+
+
+# --------------------------- Unlock schedules ---------------------------
+UNLOCK_PROJECTION_DAYS = int(os.environ.get('UNLOCK_PROJECTION_DAYS', '365'))
+DAY_SECONDS = 86400.0
+# Upper bound on release steps per linear schedule (e.g. daily over ~27 years)
+UNLOCK_MAX_STEPS = 10000
+
+# Time-sorted unlock events across all coins, rebuilt when schedules change
+_unlock_index = {
+    'key': None,
+    'epochs': np.empty(0),                      # float64, sorted
+    'coin_pos': np.empty(0, dtype=np.int64),    # index into coin_ids
+    'amounts': np.empty(0),
+    'coin_ids': np.empty(0, dtype=str),
+}
+
+
+def expand_unlock_events(kinds, starts, ends, amounts, periods, cliffs) -> tuple['np.ndarray', 'np.ndarray', 'np.ndarray']:
+    """Expand schedules into discrete release events, returning (epochs, schedule_pos, amounts).
+
+    Tranches release everything at start; linear schedules release equal steps
+    every period_days from start (exclusive) to end (inclusive). A cliff releases
+    the share vested by its cliff date in one tranche, then the remainder linearly
+    from cliff to end; cliff rows without a valid cliff/end are one-off at start.
+    """
+    kinds = np.asarray(kinds)
+    starts = np.asarray(starts, dtype=np.float64)
+    ends = np.asarray(ends, dtype=np.float64)
+    amounts = np.asarray(amounts, dtype=np.float64)
+    periods = np.asarray(periods, dtype=np.float64)
+    cliffs = np.asarray(cliffs, dtype=np.float64)
+    with np.errstate(invalid='ignore'):
+        cliffed = (kinds == 'cliff') & (cliffs >= starts) & (cliffs < ends)
+        vested = np.where(cliffed, (cliffs - starts) / np.where(cliffed, ends - starts, 1.0), 0.0)
+    # Linear part of each schedule: start->end, or cliff->end for the unvested remainder
+    lin_starts = np.where(cliffed, cliffs, starts)
+    lin_amounts = amounts * (1.0 - vested)
+    linear = ((kinds == 'linear') | cliffed) & ~np.isnan(ends)
+    duration = np.where(linear, np.nan_to_num(ends - lin_starts), 0.0)
+    linear &= duration > 0
+    period = np.where(np.isnan(periods) | (periods <= 0), 30.0, periods) * DAY_SECONDS
+    steps = np.where(linear, np.clip(np.ceil(duration / period), 1, UNLOCK_MAX_STEPS), 1).astype(np.int64)
+    # Step spacing may widen when clipped so the last step still lands on end
+    spacing = np.where(linear, duration / steps, 0.0)
+
+    pos = np.repeat(np.arange(len(starts)), steps)
+    # 1-based step number within each schedule
+    k = np.arange(len(pos)) - np.repeat(np.cumsum(steps) - steps, steps) + 1
+    epochs = lin_starts[pos] + k * spacing[pos]
+    event_amounts = lin_amounts[pos] / steps[pos]
+
+    # Cliff tranches for the share vested before the cliff
+    lump_pos = np.flatnonzero(cliffed & (vested > 0))
+    if len(lump_pos):
+        epochs = np.concatenate([epochs, cliffs[lump_pos]])
+        pos = np.concatenate([pos, lump_pos])
+        event_amounts = np.concatenate([event_amounts, amounts[lump_pos] * vested[lump_pos]])
+    return epochs, pos, event_amounts
+
+
+def get_unlock_index() -> dict:
+    """Return the unlock event index, rebuilding it if any schedule was added, edited or removed."""
+    key = db.session.query(
+        db.func.count(UnlockSchedule.id), db.func.max(UnlockSchedule.updated_epoch), db.func.max(UnlockSchedule.id)
+    ).one()
+    key = tuple(key)
+    if _unlock_index['key'] == key:
+        return _unlock_index
+    rows = db.session.query(
+        UnlockSchedule.coin_id, UnlockSchedule.kind, UnlockSchedule.start_epoch,
+        UnlockSchedule.end_epoch, UnlockSchedule.amount, UnlockSchedule.period_days,
+        UnlockSchedule.cliff_epoch,
+    ).all()
+    if rows:
+        coin_ids, kinds, starts, ends, amounts, periods, cliffs = zip(*rows)
+        to_float = lambda seq: np.array([np.nan if v is None else v for v in seq], dtype=np.float64)
+        epochs, pos, event_amounts = expand_unlock_events(
+            np.array(kinds), to_float(starts), to_float(ends), to_float(amounts), to_float(periods),
+            to_float(cliffs),
+        )
+        coin_ids, coin_pos = np.unique(np.asarray(coin_ids, dtype=str)[pos], return_inverse=True)
+        order = np.argsort(epochs, kind='stable')
+        _unlock_index.update({
+            'epochs': epochs[order],
+            'coin_pos': coin_pos[order],
+            'amounts': event_amounts[order],
+            'coin_ids': coin_ids,
+        })
+    else:
+        _unlock_index.update({
+            'epochs': np.empty(0),
+            'coin_pos': np.empty(0, dtype=np.int64),
+            'amounts': np.empty(0),
+            'coin_ids': np.empty(0, dtype=str),
+        })
+    _unlock_index['key'] = key
+    return _unlock_index
+
+
+def unlocks_between(start_epoch: float, end_epoch: float) -> dict:
+    """Return {coin_id: (amount, first_event_epoch, event_count)} for unlocks in (start, end]."""
+    index = get_unlock_index()
+    lo = np.searchsorted(index['epochs'], start_epoch, side='right')
+    hi = np.searchsorted(index['epochs'], end_epoch, side='right')
+    pos = index['coin_pos'][lo:hi]
+    n = len(index['coin_ids'])
+    totals = np.bincount(pos, weights=index['amounts'][lo:hi], minlength=n)
+    counts = np.bincount(pos, minlength=n)
+    # Events are time-sorted, so the first occurrence per coin is its next unlock
+    first = np.full(n, np.nan)
+    uniq, first_idx = np.unique(pos, return_index=True)
+    first[uniq] = index['epochs'][lo:hi][first_idx]
+    return {
+        str(index['coin_ids'][i]): (float(totals[i]), float(first[i]), int(counts[i]))
+        for i in np.flatnonzero(counts)
+    }
+
+
+def compute_valuation_prices(coin: 'Coin', supply) -> tuple[float | None, float | None]:
+    """Return (financing_based_price, income_based_price) for a given supply.
+
+    financing_based_price = found_raises / (supply * investor fraction)
+    income_based_price = income_valuation / supply
+    """
+    computed_fbp = None
+    computed_ibp = None
+    try:
+        found_raises = coin.found_raises
+        investor_pct = coin.investor_percentage
+        if supply and supply > 0 and found_raises and investor_pct:
+            investor_fraction = investor_pct if investor_pct <= 1 else investor_pct / 100.0
+            denom = supply * investor_fraction
+            if denom:
+                computed_fbp = float(found_raises) / float(denom)
+        income_valuation = coin.income_valuation
+        if supply and supply > 0 and income_valuation:
+            computed_ibp = float(income_valuation) / float(supply)
+    except Exception:
+        computed_fbp = None
+        computed_ibp = None
+    return computed_fbp, computed_ibp
+
+
 def resolve_coingecko_id(user_input: str) -> str:
     """Resolve user-entered text to a CoinGecko API coin id.
 
@@ -306,7 +958,7 @@ def _validate_csrf() -> bool:
     if request.method != 'POST':
         return True
     # Only protect HTML form endpoints
-    protected_endpoints = {'manage', 'edit_coin', 'delete_coin', 'login'}
+    protected_endpoints = {'manage', 'create_portfolio', 'edit_coin', 'delete_coin', 'manage_unlocks', 'delete_unlock', 'login'}
     if request.endpoint not in protected_endpoints:
         return True
     sent = request.form.get('csrf_token') or request.headers.get('X-CSRFToken')
@@ -318,12 +970,29 @@ def _csrf_before_request():
     if not _validate_csrf():
         return make_response(('CSRF token missing or invalid', 400))
 
+def _portfolio_or_none(portfolio_slug: str | None):
+    """Return (portfolio, found). No slug means the whole book: (None, True)."""
+    if portfolio_slug is None:
+        return None, True
+    portfolio = Portfolio.query.filter_by(slug=portfolio_slug).first()
+    return portfolio, portfolio is not None
+
+
+def _portfolio_not_found():
+    return make_response(jsonify({'error': 'unknown portfolio'}), 404)
+
+
 @app.route('/')
-def index():
+@app.route('/p/<portfolio_slug>')
+def index(portfolio_slug: str | None = None):
     # Keep homepage rendering lightweight to avoid upstream-induced 502s.
     # Data is loaded client-side via /api/data with caching and timeouts.
+    portfolio, found = _portfolio_or_none(portfolio_slug)
+    if not found:
+        return render_template('error.html', code=404, message='组合不存在'), 404
     _get_or_create_csrf_token()
-    resp = make_response(render_template('index.html'))
+    data_url = url_for('api_data', portfolio_slug=portfolio.slug) if portfolio else url_for('api_data')
+    resp = make_response(render_template('index.html', portfolio=portfolio, data_url=data_url))
     # Cache-control for HTML (short)
     resp.headers['Cache-Control'] = 'private, max-age=30'
     return resp
@@ -392,6 +1061,12 @@ def logout():
 @require_admin
 def manage():
     error_message = None
+    portfolio = None
+    portfolio_slug = request.args.get('portfolio')
+    if portfolio_slug:
+        portfolio = Portfolio.query.filter_by(slug=portfolio_slug).first()
+    if not portfolio:
+        portfolio = get_default_portfolio()
     if request.method == 'POST':
         coin_id = (request.form.get('coin_id') or '').strip()
 
@@ -421,7 +1096,7 @@ def manage():
         if valid_ids and resolved_id not in valid_ids:
             error_message = f"无效的 CoinGecko 代币ID: {coin_id}"
         else:
-            coin = Coin.query.filter_by(coin_id=coin_id).first()
+            coin = Coin.query.filter_by(portfolio_id=portfolio.id, coin_id=coin_id).first()
             if coin:
                 coin.buy_price = buy_price
                 coin.amount = amount
@@ -438,6 +1113,7 @@ def manage():
                 coin.tags = tags
             else:
                 coin = Coin(
+                    portfolio_id=portfolio.id,
                     coin_id=resolved_id,
                     buy_price=buy_price,
                     amount=amount,
@@ -460,10 +1136,29 @@ def manage():
                 db.session.rollback()
                 error_message = f"数据库写入失败: {e}"
             else:
-                return redirect(url_for('manage'))
+                return redirect(url_for('manage', portfolio=portfolio.slug))
+
+    coins = Coin.query.filter_by(portfolio_id=portfolio.id).all()
+    portfolios = Portfolio.query.order_by(Portfolio.slug).all()
+    return render_template('manage.html', coins=coins, portfolio=portfolio, portfolios=portfolios, error=error_message)
 
-    coins = Coin.query.all()
-    return render_template('manage.html', coins=coins, error=error_message)
+@app.route('/manage/portfolios', methods=['POST'])
+@require_admin
+def create_portfolio():
+    import re
+    slug = (request.form.get('slug') or '').strip().lower()
+    name = (request.form.get('name') or '').strip() or slug
+    if not re.fullmatch(r'[a-z0-9][a-z0-9_-]{0,49}', slug):
+        flash('组合标识只能包含小写字母、数字、- 和 _', 'portfolio')
+        return redirect(url_for('manage'))
+    if not Portfolio.query.filter_by(slug=slug).first():
+        db.session.add(Portfolio(slug=slug, name=name))
+        try:
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            app.logger.exception("Failed to create portfolio %s", slug)
+    return redirect(url_for('manage', portfolio=slug))
 
 @app.route('/manage/edit/<int:coin_db_id>', methods=['GET', 'POST'])
 @require_admin
@@ -518,38 +1213,111 @@ def edit_coin(coin_db_id: int):
                 db.session.rollback()
                 error_message = f"数据库写入失败: {e}"
             else:
-                return redirect(url_for('manage'))
+                return redirect(url_for('manage', portfolio=coin.portfolio.slug))
 
     return render_template('edit.html', coin=coin, error=error_message)
 
+@app.route('/manage/unlocks/<int:coin_db_id>', methods=['GET', 'POST'])
+@require_admin
+def manage_unlocks(coin_db_id: int):
+    coin = db.session.get(Coin, coin_db_id)
+    if not coin:
+        return redirect(url_for('manage'))
+
+    error_message = None
+    if request.method == 'POST':
+        from datetime import datetime, timezone
+
+        def to_epoch(v):
+            # Dates are entered as YYYY-MM-DD (UTC)
+            if not v:
+                return None
+            return datetime.strptime(v, '%Y-%m-%d').replace(tzinfo=timezone.utc).timestamp()
+
+        kind = request.form.get('kind', 'tranche')
+        try:
+            amount = float(request.form.get('amount') or 0)
+            start_epoch = to_epoch(request.form.get('start_date'))
+            cliff_epoch = to_epoch(request.form.get('cliff_date'))
+            end_epoch = to_epoch(request.form.get('end_date'))
+            period_days = float(request.form['period_days']) if request.form.get('period_days') else None
+        except ValueError:
+            error_message = "日期格式应为 YYYY-MM-DD，数量/周期需为数字"
+        else:
+            if kind not in UNLOCK_KINDS:
+                error_message = f"无效的解锁类型: {kind}"
+            elif not math.isfinite(amount) or (period_days is not None and not math.isfinite(period_days)):
+                error_message = "数量/周期需为有限数字"
+            elif amount <= 0 or start_epoch is None:
+                error_message = "数量和开始日期为必填项"
+            elif period_days is not None and period_days <= 0:
+                error_message = "释放周期需大于 0"
+            elif kind in ('linear', 'cliff') and (end_epoch is None or end_epoch <= start_epoch):
+                error_message = "线性/cliff 解锁需要晚于开始日期的结束日期"
+            elif kind == 'cliff' and (cliff_epoch is None or not start_epoch <= cliff_epoch < end_epoch):
+                error_message = "cliff 日期需介于开始日期与结束日期之间"
+        if not error_message:
+            db.session.add(UnlockSchedule(
+                coin_id=coin.coin_id,
+                kind=kind,
+                label=(request.form.get('label') or '').strip() or None,
+                amount=amount,
+                start_epoch=start_epoch,
+                cliff_epoch=cliff_epoch if kind == 'cliff' else None,
+                end_epoch=end_epoch if kind != 'tranche' else None,
+                period_days=period_days if kind != 'tranche' else None,
+            ))
+            try:
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                error_message = f"数据库写入失败: {e}"
+            else:
+                return redirect(url_for('manage_unlocks', coin_db_id=coin.id))
+
+    schedules = UnlockSchedule.query.filter_by(coin_id=coin.coin_id).order_by(UnlockSchedule.start_epoch).all()
+    return render_template('unlocks.html', coin=coin, schedules=schedules, kinds=UNLOCK_KINDS, error=error_message)
+
+@app.route('/manage/unlocks/delete/<int:unlock_id>', methods=['POST'])
+@require_admin
+def delete_unlock(unlock_id: int):
+    schedule = db.session.get(UnlockSchedule, unlock_id)
+    # Schedules belong to the token; return to the position page we came from
+    coin_db_id = request.form.get('coin_db_id', type=int)
+    try:
+        if schedule:
+            db.session.delete(schedule)
+            db.session.commit()
+    except Exception:
+        db.session.rollback()
+        app.logger.exception("Failed to delete unlock schedule %s", unlock_id)
+    if coin_db_id is None:
+        return redirect(url_for('manage'))
+    return redirect(url_for('manage_unlocks', coin_db_id=coin_db_id))
+
 @app.route('/api/data')
-def api_data():
+@app.route('/p/<portfolio_slug>/api/data')
+def api_data(portfolio_slug: str | None = None):
+    portfolio, found = _portfolio_or_none(portfolio_slug)
+    if not found:
+        return _portfolio_not_found()
     data_dict, last_epoch, ttl = get_cached_market_data(ttl_seconds=300)
-    coins = Coin.query.all()
+    coins = Coin.query.filter_by(portfolio_id=portfolio.id).all() if portfolio else Coin.query.all()
+    now = time.time()
+    upcoming = unlocks_between(now, now + UNLOCK_PROJECTION_DAYS * DAY_SECONDS)
     table_data = []
     for coin in coins:
         market = data_dict.get(coin.coin_id)
-        # Compute financing_based_price if inputs available
-        computed_fbp = None
-        computed_ibp = None
-        try:
-            total_supply = (market or {}).get('total_supply')
-            found_raises = coin.found_raises
-            investor_pct = coin.investor_percentage
-            if total_supply and total_supply > 0 and found_raises and investor_pct:
-                investor_fraction = investor_pct if investor_pct <= 1 else investor_pct / 100.0
-                denom = total_supply * investor_fraction
-                if denom:
-                    computed_fbp = float(found_raises) / float(denom)
-            # Compute income_based_price = income_valuation / total_supply
-            income_valuation = coin.income_valuation
-            if total_supply and total_supply > 0 and income_valuation:
-                computed_ibp = float(income_valuation) / float(total_supply)
-        except Exception:
-            computed_fbp = None
-            computed_ibp = None
+        total_supply = (market or {}).get('total_supply')
+        computed_fbp, computed_ibp = compute_valuation_prices(coin, total_supply)
+        # Projected supply: circulating plus scheduled unlocks over the projection horizon
+        circulating = (market or {}).get('circulating_supply')
+        unlock_amount = upcoming.get(coin.coin_id, (0.0, None, 0))[0]
+        projected_supply = (circulating + unlock_amount) if circulating else None
+        projected_fbp, projected_ibp = compute_valuation_prices(coin, projected_supply)
 
         table_row = {
+            'portfolio': coin.portfolio.slug if coin.portfolio else None,
             'coin_id': coin.coin_id,
             'coin_name': (market or {}).get('name') or coin.coin_id,
             'price': (market or {}).get('current_price'),
@@ -567,6 +1335,9 @@ def api_data():
             'annualized_income': coin.annualized_income,
             'income_valuation': coin.income_valuation,
             'income_based_price': computed_ibp if computed_ibp is not None else coin.income_based_price,
+            'projected_supply': projected_supply,
+            'projected_financing_based_price': projected_fbp,
+            'projected_income_based_price': projected_ibp,
             'tokenomics': coin.tokenomics,
             'vesting': coin.vesting,
             'cexs': coin.cexs,
@@ -595,9 +1366,14 @@ def api_data():
     return resp
 
 @app.route('/api/prices')
-def api_prices():
-    data_dict = fetch_market_data_for_configured_coins()
-    coins = Coin.query.all()
+@app.route('/p/<portfolio_slug>/api/prices')
+def api_prices(portfolio_slug: str | None = None):
+    portfolio, found = _portfolio_or_none(portfolio_slug)
+    if not found:
+        return _portfolio_not_found()
+    # Served from the shared watchlist cache rather than a per-request CoinGecko call
+    data_dict, _, _ = get_cached_market_data(ttl_seconds=300)
+    coins = Coin.query.filter_by(portfolio_id=portfolio.id).all() if portfolio else Coin.query.all()
     response = []
     for coin in coins:
         market = data_dict.get(coin.coin_id)
@@ -610,6 +1386,8 @@ def api_prices():
         if current_price is not None and buy_price and amount:
             profit = (current_price - buy_price) * amount
         response.append({
+            'portfolio': coin.portfolio.slug if coin.portfolio else None,
+            'coin_id': coin.coin_id,
             'name': market.get('name'),
             'current_price': float(current_price) if current_price is not None else None,
             'buy_price': float(buy_price) if buy_price is not None else None,
@@ -620,20 +1398,208 @@ def api_prices():
     resp.headers['Cache-Control'] = 'public, max-age=30'
     return resp
 
+@app.route('/api/ohlc/<coin_id>')
+def api_ohlc(coin_id: str):
+    """OHLC candles aggregated from the cached market chart.
+
+    Query params: interval (e.g. 1h, 4h, 1d; default 1d), optional from/to epoch seconds.
+    """
+    # Only serve configured coins so arbitrary ids can't burn the CoinGecko budget
+    if not Coin.query.filter_by(coin_id=coin_id).first():
+        return make_response(jsonify({'error': 'unknown coin'}), 404)
+    interval = request.args.get('interval', '1d')
+    interval_ms = parse_ohlc_interval(interval)
+    if not interval_ms:
+        return make_response(jsonify({'error': f'invalid interval: {interval}'}), 400)
+    try:
+        bounds = []
+        for name in ('from', 'to'):
+            value = float(request.args[name]) if request.args.get(name) else None
+            if value is not None and not math.isfinite(value):
+                raise ValueError(name)
+            bounds.append(int(value * 1000) if value is not None else None)
+        from_ms, to_ms = bounds
+    except (ValueError, OverflowError):
+        return make_response(jsonify({'error': 'from/to must be epoch seconds'}), 400)
+
+    arrays = get_market_chart(coin_id)
+    ts, prices = arrays['ts'], arrays['prices']
+    lo = np.searchsorted(ts, from_ms, side='left') if from_ms is not None else 0
+    hi = np.searchsorted(ts, to_ms, side='right') if to_ms is not None else len(ts)
+    candles = resample_ohlc(ts[lo:hi], prices[lo:hi], interval_ms)
+    response = {
+        'coin_id': coin_id,
+        'interval': interval,
+        'candles': candles,
+        'last_point_epoch': (int(ts[-1]) / 1000.0) if len(ts) else None,
+    }
+    resp = make_response(jsonify(response))
+    resp.headers['Cache-Control'] = 'public, max-age=60'
+    return resp
+
+def _risk_cache_key(positions: list, days: int, window: int, confidence: float) -> tuple:
+    """Changes whenever holdings, cached chart files or the current day change."""
+    parts = []
+    for coin_id, amount in positions:
+        try:
+            mtime = _chart_path(coin_id).stat().st_mtime
+        except OSError:
+            mtime = None
+        parts.append((coin_id, amount, mtime))
+    return (int(time.time() * 1000) // DAY_MS, days, window, confidence, tuple(parts))
+
+
+def _risk_body(entry: dict, include_corr: bool) -> tuple[bytes, str]:
+    """Serialize a cached risk result once per variant; later hits reuse the bytes."""
+    bodies = entry['bodies']
+    if include_corr not in bodies:
+        import hashlib, json as _json
+        payload = dict(entry['result'])
+        if include_corr:
+            payload['correlation'] = [_nan_to_none(row) for row in entry['correlation']]
+        body = _json.dumps(payload, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+        bodies[include_corr] = (body, hashlib.sha1(body).hexdigest())
+    return bodies[include_corr]
+
+
+@app.route('/api/risk')
+@app.route('/p/<portfolio_slug>/api/risk')
+def api_risk(portfolio_slug: str | None = None):
+    """Portfolio risk metrics for held coins from cached daily price series.
+
+    Without a portfolio, positions in the same coin across portfolios are summed.
+
+    Query params: days (default 365), window (rolling volatility, default 30),
+    confidence (VaR, default 0.95), correlation=1 to include the N x N matrix.
+    """
+    try:
+        days = min(max(int(request.args.get('days', 365)), 2), 3650)
+        window = min(max(int(request.args.get('window', 30)), 2), days)
+        confidence = float(request.args.get('confidence', 0.95))
+    except ValueError:
+        return make_response(jsonify({'error': 'invalid parameters'}), 400)
+    if not 0.5 <= confidence < 1.0:
+        return make_response(jsonify({'error': 'confidence must be in [0.5, 1)'}), 400)
+    include_corr = request.args.get('correlation', '0').lower() in ('1', 'true', 'yes')
+    portfolio, found = _portfolio_or_none(portfolio_slug)
+    if not found:
+        return _portfolio_not_found()
+
+    query = db.session.query(Coin.coin_id, db.func.sum(Coin.amount))
+    if portfolio:
+        query = query.filter(Coin.portfolio_id == portfolio.id)
+    positions = [
+        (coin_id, amount) for coin_id, amount in query.group_by(Coin.coin_id).order_by(Coin.coin_id).all()
+        if amount
+    ]
+    slug = portfolio.slug if portfolio else None
+    key = _risk_cache_key(positions, days, window, confidence)
+    entry = _risk_cache.get(slug)
+    if entry is None or entry['key'] != key:
+        coin_ids = [coin_id for coin_id, _ in positions]
+        amounts = np.array([amount for _, amount in positions], dtype=np.float64)
+        day_ms, prices, missing = build_daily_price_matrix(coin_ids, days)
+        metrics = compute_risk_metrics(prices, amounts, window=window, confidence=confidence)
+        per_coin = metrics['coins']
+        port_metrics = dict(metrics['portfolio'])
+        port_metrics['volatility_series'] = _nan_to_none(port_metrics['volatility_series'])
+        result = {
+            'coin_ids': coin_ids,
+            'missing': missing,
+            'start_epoch': int(day_ms[0]) / 1000.0,
+            'end_epoch': int(day_ms[-1]) / 1000.0,
+            'window': window,
+            'confidence': confidence,
+            'coins': {k: _nan_to_none(v) for k, v in per_coin.items()},
+            'portfolio': port_metrics,
+            'computed_epoch': time.time(),
+        }
+        entry = _risk_cache[slug] = {
+            # Re-key after the build: it may have filled chart caches
+            'key': _risk_cache_key(positions, days, window, confidence),
+            'result': result,
+            'correlation': metrics['correlation'],
+            'bodies': {},
+        }
+    body, etag = _risk_body(entry, include_corr)
+    if etag in request.if_none_match:
+        resp = make_response('', 304)
+    else:
+        resp = make_response(body)
+        resp.mimetype = 'application/json'
+    resp.headers['ETag'] = etag
+    resp.headers['Cache-Control'] = 'public, max-age=60'
+    return resp
+
+@app.route('/api/unlocks')
+@app.route('/p/<portfolio_slug>/api/unlocks')
+def api_unlocks(portfolio_slug: str | None = None):
+    """Upcoming unlocks across the book from the unlock event index.
+
+    Query params: days (horizon, default 30), min_pct (minimum unlock as % of
+    circulating supply, falling back to total supply; default 0).
+    """
+    try:
+        days = float(request.args.get('days', 30))
+        min_pct = float(request.args.get('min_pct', 0))
+    except ValueError:
+        return make_response(jsonify({'error': 'invalid parameters'}), 400)
+    if not (math.isfinite(days) and math.isfinite(min_pct)) or days < 0:
+        return make_response(jsonify({'error': 'days and min_pct must be finite, days >= 0'}), 400)
+    portfolio, found = _portfolio_or_none(portfolio_slug)
+    if not found:
+        return _portfolio_not_found()
+    now = time.time()
+    upcoming = unlocks_between(now, now + days * DAY_SECONDS)
+    data_dict, _, _ = get_cached_market_data(ttl_seconds=300)
+    # One row per held token; amounts are summed across portfolios for the whole book
+    query = db.session.query(Coin.coin_id, db.func.sum(Coin.amount)).filter(Coin.coin_id.in_(list(upcoming)))
+    if portfolio:
+        query = query.filter(Coin.portfolio_id == portfolio.id)
+    held = query.group_by(Coin.coin_id).all() if upcoming else []
+    rows = []
+    for coin_id, amount_held in held:
+        unlock_amount, next_epoch, event_count = upcoming[coin_id]
+        market = data_dict.get(coin_id) or {}
+        circulating = market.get('circulating_supply')
+        total_supply = market.get('total_supply')
+        price = market.get('current_price')
+        pct_circ = unlock_amount / circulating * 100.0 if circulating else None
+        pct_total = unlock_amount / total_supply * 100.0 if total_supply else None
+        pct = pct_circ if pct_circ is not None else pct_total
+        if min_pct and (pct is None or pct < min_pct):
+            continue
+        rows.append({
+            'coin_id': coin_id,
+            'amount_held': amount_held,
+            'unlock_amount': unlock_amount,
+            'unlock_value_usd': unlock_amount * price if price is not None else None,
+            'next_unlock_epoch': next_epoch,
+            'event_count': event_count,
+            'pct_of_circulating': pct_circ,
+            'pct_of_total': pct_total,
+        })
+    rows.sort(key=lambda r: -(r['pct_of_circulating'] if r['pct_of_circulating'] is not None else (r['pct_of_total'] or 0.0)))
+    resp = make_response(jsonify({'days': days, 'rows': rows}))
+    resp.headers['Cache-Control'] = 'public, max-age=60'
+    return resp
+
 @app.route('/manage/delete/<int:coin_db_id>', methods=['POST', 'GET'])
 @require_admin
 def delete_coin(coin_db_id: int):
     # Support both POST (form) and GET (direct link) to reduce 405/500 issues behind some proxies
+    portfolio_slug = None
     try:
         coin = db.session.get(Coin, coin_db_id)
         if coin:
+            portfolio_slug = coin.portfolio.slug
             db.session.delete(coin)
             db.session.commit()
     except Exception:
         db.session.rollback()
         # Best-effort: log and continue redirect to manage
         app.logger.exception("Failed to delete coin %s", coin_db_id)
-    return redirect(url_for('manage'))
+    return redirect(url_for('manage', portfolio=portfolio_slug))
 
 @app.route('/api/coin_ids')
 def api_coin_ids():
@@ -659,6 +1625,13 @@ def not_found(e):
 def server_error(e):
     return render_template('error.html', code=500, message='服务器错误'), 500
 
+@app.template_filter('utc_date')
+def utc_date(epoch):
+    if not epoch:
+        return ''
+    from datetime import datetime, timezone
+    return datetime.fromtimestamp(epoch, tz=timezone.utc).strftime('%Y-%m-%d')
+
 @app.context_processor
 def inject_version():
     return {
@@ -670,6 +1643,110 @@ def inject_version():
 
     
 
+# --------------------------- Scheduled reports ---------------------------
+# Daily snapshot reports (see report.py). Set REPORT_SCHEDULE_UTC=HH:MM to run in-app;
+# each worker starts a timer, and a per-day lock file (holding "<pid> <epoch>") lets
+# only one of them write at a time. Until the day's partition exists, every worker
+# checks again every REPORT_RETRY_SECONDS; a lock whose process is gone or that is
+# older than REPORT_LOCK_STALE_SECONDS (worker recycled or killed mid-run) is taken over.
+REPORT_SCHEDULE_UTC = os.environ.get('REPORT_SCHEDULE_UTC')
+REPORT_RETRY_SECONDS = 900
+REPORT_LOCK_STALE_SECONDS = 3600
+# Market cache older than this counts as a failed fetch for the report
+REPORT_MAX_MARKET_AGE_SECONDS = 3600
+
+
+def _cached_market_lookup(coin_ids: list[str]) -> dict:
+    data_dict, last_epoch, _ = get_cached_market_data(ttl_seconds=300)
+    if not last_epoch or time.time() - last_epoch > REPORT_MAX_MARKET_AGE_SECONDS:
+        raise RuntimeError("market data cache is empty or stale")
+    return {cid: data_dict[cid] for cid in coin_ids if cid in data_dict}
+
+
+def _report_lock_is_stale(lock_path: Path, pid_alive) -> bool:
+    try:
+        pid, started = lock_path.read_text().split()
+        pid, started = int(pid), float(started)
+    except (OSError, ValueError):
+        # Unreadable, or caught between create and write: judge by file age
+        try:
+            return time.time() - lock_path.stat().st_mtime > REPORT_LOCK_STALE_SECONDS
+        except OSError:
+            return False
+    return not pid_alive(pid) or time.time() - started > REPORT_LOCK_STALE_SECONDS
+
+
+def _run_scheduled_report(snapshot_date: str) -> bool:
+    """Write the day's partition unless it exists; False while another live worker holds the lock."""
+    import sys
+    # report.py imports from "app"; reuse this module when started as __main__
+    sys.modules.setdefault('app', sys.modules[__name__])
+    from report import generate_daily_report, pid_alive
+
+    lock_path = DB_DIR / f'report-{snapshot_date}.lock'
+    # Locks from earlier days are finished with
+    for old_lock in DB_DIR.glob('report-*.lock'):
+        if old_lock.name < lock_path.name:
+            old_lock.unlink(missing_ok=True)
+    try:
+        fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        if not _report_lock_is_stale(lock_path, pid_alive):
+            return False
+        app.logger.warning("Taking over stale report lock %s", lock_path.name)
+        lock_path.unlink(missing_ok=True)
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+    with os.fdopen(fd, 'w') as lock_file:
+        lock_file.write(f'{os.getpid()} {time.time()}')
+    try:
+        # Returns None when the partition already exists; either way the day is done
+        generate_daily_report(snapshot_date, market_lookup=_cached_market_lookup)
+    finally:
+        lock_path.unlink(missing_ok=True)
+    return True
+
+
+def _report_scheduler_loop(hour: int, minute: int) -> None:
+    from datetime import datetime, timedelta, timezone
+    while True:
+        now = datetime.now(timezone.utc)
+        next_run = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        if next_run <= now:
+            next_run += timedelta(days=1)
+        time.sleep((next_run - now).total_seconds())
+        snapshot_date = next_run.strftime('%Y-%m-%d')
+        while True:
+            try:
+                if _run_scheduled_report(snapshot_date):
+                    break
+                app.logger.info("Report for %s is being written by another worker; checking again in %ss", snapshot_date, REPORT_RETRY_SECONDS)
+            except Exception:
+                app.logger.exception("Scheduled report for %s failed; retrying in %ss", snapshot_date, REPORT_RETRY_SECONDS)
+            time.sleep(REPORT_RETRY_SECONDS)
+            if datetime.now(timezone.utc).strftime('%Y-%m-%d') != snapshot_date:
+                app.logger.error("Giving up on scheduled report for %s", snapshot_date)
+                break
+
+
+def start_report_scheduler() -> None:
+    import threading
+    try:
+        hour, minute = (int(part) for part in REPORT_SCHEDULE_UTC.split(':'))
+        if not (0 <= hour < 24 and 0 <= minute < 60):
+            raise ValueError(REPORT_SCHEDULE_UTC)
+    except ValueError:
+        app.logger.error("Invalid REPORT_SCHEDULE_UTC %r, expected HH:MM", REPORT_SCHEDULE_UTC)
+        return
+    threading.Thread(target=_report_scheduler_loop, args=(hour, minute), name='report-scheduler', daemon=True).start()
+
+
+if REPORT_SCHEDULE_UTC:
+    start_report_scheduler()
+
+
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()
@@ -685,7 +1762,8 @@ if __name__ == '__main__':
             db.session.rollback()
         # Seed with a few popular coins if database is empty
         if Coin.query.count() == 0:
+            default_portfolio = get_default_portfolio()
             for coin_id in ['bitcoin', 'ethereum', 'solana']:
-                db.session.add(Coin(coin_id=coin_id))
+                db.session.add(Coin(portfolio_id=default_portfolio.id, coin_id=coin_id))
             db.session.commit()
     app.run(debug=True)
\ No newline at end of file
@@ -1,10 +1,12 @@
-from app import app, db, Coin
+from app import app, db, Coin, get_default_portfolio, migrate_coin_to_portfolios
 from sqlalchemy import inspect, text
 
 
 def initialize_database() -> None:
     with app.app_context():
         db.create_all()
+        # Move a pre-portfolio coin table into the default portfolio
+        migrate_coin_to_portfolios()
         # Add new columns if missing (simple migrate)
         inspector = inspect(db.engine)
         cols = {c['name'] for c in inspector.get_columns('coin')}
@@ -38,8 +40,9 @@ def initialize_database() -> None:
                 except Exception:
                     db.session.rollback()
         if Coin.query.count() == 0:
+            default_portfolio = get_default_portfolio()
             for coin_id in ["bitcoin", "ethereum", "solana"]:
-                db.session.add(Coin(coin_id=coin_id))
+                db.session.add(Coin(portfolio_id=default_portfolio.id, coin_id=coin_id))
             db.session.commit()
 
 
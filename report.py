@@ -0,0 +1,361 @@
+"""Daily portfolio snapshot reports.
+
+Streams every Coin row joined with its market snapshot into
+reports/snapshots/date=YYYY-MM-DD/ as snapshot.csv.gz, snapshot.jsonl.gz and
+(when pyarrow is installed) snapshot.parquet, plus a compact diff against the
+previous partition. Rows are read, enriched and written in batches of up to
+BATCH_SIZE distinct coins (one /coins/markets call each), so memory stays flat
+regardless of book size. A market fetch that still fails after retries aborts
+the run and leaves no partition behind.
+
+Snapshots are always of current market data, so only today's (UTC) partition
+can be written; past days cannot be backfilled.
+
+Usage: python report.py [--force]
+"""
+from app import app, db, Coin, Portfolio, compute_valuation_prices, _fetch_markets_via_requests, MARKETS_PAGE_SIZE
+from datetime import datetime, timezone
+from pathlib import Path
+import argparse
+import csv
+import gzip
+import json
+import logging
+import os
+import shutil
+import time
+
+REPORTS_DIR = Path(__file__).resolve().parent / 'reports'
+SNAPSHOTS_DIR = REPORTS_DIR / 'snapshots'
+# Distinct coin ids per batch: one /coins/markets page
+BATCH_SIZE = MARKETS_PAGE_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Column order for every output format; (name, type) with type in float/str
+SNAPSHOT_COLUMNS = [
+    ('snapshot_date', 'str'),
+    ('coin_id', 'str'),
+    ('portfolio', 'str'),
+    ('coin_name', 'str'),
+    ('amount', 'float'),
+    ('buy_price', 'float'),
+    ('price', 'float'),
+    ('value_usd', 'float'),
+    ('pnl_usd', 'float'),
+    ('pct_24h', 'float'),
+    ('pct_7d', 'float'),
+    ('current_supply', 'float'),
+    ('total_supply', 'float'),
+    ('current_market_cap', 'float'),
+    ('total_market_cap', 'float'),
+    ('found_raises', 'float'),
+    ('investor_percentage', 'float'),
+    ('financing_valuation', 'float'),
+    ('financing_based_price', 'float'),
+    ('annualized_income', 'float'),
+    ('income_valuation', 'float'),
+    ('income_based_price', 'float'),
+    ('tokenomics', 'str'),
+    ('vesting', 'str'),
+    ('cexs', 'str'),
+    ('tags', 'str'),
+]
+COLUMN_NAMES = [name for name, _ in SNAPSHOT_COLUMNS]
+# Rows are written sorted by this key so diffs can merge-join two files
+KEY_COLUMNS = ('coin_id', 'portfolio')
+DIFF_IGNORED = {'snapshot_date'}
+
+
+def fetch_market_batch(coin_ids: list[str]) -> dict:
+    """Fetch /coins/markets for one batch of ids, retrying with backoff like the app cache.
+
+    Raises once retries are exhausted: a snapshot without prices must not look complete.
+    """
+    backoff = 1.0
+    for attempt in range(3):
+        try:
+            return {m.get('id'): m for m in _fetch_markets_via_requests(coin_ids) if m.get('id')}
+        except Exception as e:
+            error = e
+            if attempt < 2:
+                time.sleep(backoff)
+                backoff *= 2
+    raise RuntimeError(f"market data fetch failed for {len(coin_ids)} coin ids") from error
+
+
+def _snapshot_row(snapshot_date: str, coin, market: dict) -> dict:
+    """coin is a row of coin columns plus portfolio_slug."""
+    total_supply = market.get('total_supply')
+    computed_fbp, computed_ibp = compute_valuation_prices(coin, total_supply)
+    price = market.get('current_price')
+    value = price * coin.amount if price is not None and coin.amount else None
+    pnl = (price - coin.buy_price) * coin.amount if price is not None and coin.buy_price and coin.amount else None
+    return {
+        'snapshot_date': snapshot_date,
+        'coin_id': coin.coin_id,
+        'portfolio': coin.portfolio_slug,
+        'coin_name': market.get('name') or coin.coin_id,
+        'amount': coin.amount,
+        'buy_price': coin.buy_price,
+        'price': price,
+        'value_usd': value,
+        'pnl_usd': pnl,
+        'pct_24h': market.get('price_change_percentage_24h_in_currency', market.get('price_change_percentage_24h')),
+        'pct_7d': market.get('price_change_percentage_7d_in_currency'),
+        'current_supply': market.get('circulating_supply'),
+        'total_supply': total_supply,
+        'current_market_cap': market.get('market_cap'),
+        'total_market_cap': market.get('fully_diluted_valuation'),
+        'found_raises': coin.found_raises,
+        'investor_percentage': coin.investor_percentage,
+        'financing_valuation': coin.financing_valuation,
+        'financing_based_price': computed_fbp if computed_fbp is not None else coin.financing_based_price,
+        'annualized_income': coin.annualized_income,
+        'income_valuation': coin.income_valuation,
+        'income_based_price': computed_ibp if computed_ibp is not None else coin.income_based_price,
+        'tokenomics': coin.tokenomics,
+        'vesting': coin.vesting,
+        'cexs': coin.cexs,
+        'tags': coin.tags,
+    }
+
+
+def iter_snapshot_batches(snapshot_date: str, market_lookup=fetch_market_batch, batch_size: int = BATCH_SIZE):
+    """Yield lists of snapshot rows ordered by (coin_id, portfolio).
+
+    Positions are streamed from the database and cut into batches of at most
+    batch_size distinct coin ids (a coin's positions are never split), so market
+    data is looked up once per batch_size coins however many portfolios hold them.
+    """
+    # Plain column rows rather than ORM instances: nothing accumulates in the session
+    query = (
+        db.session.query(*Coin.__table__.columns, Portfolio.slug.label('portfolio_slug'))
+        .join(Portfolio, Coin.portfolio_id == Portfolio.id)
+        .order_by(Coin.coin_id, Portfolio.slug)
+        .yield_per(batch_size)
+    )
+    batch = []
+    distinct = 0
+    for row in query:
+        # Rows arrive ordered by coin_id, so a new id differs from the previous row's
+        if not batch or row.coin_id != batch[-1].coin_id:
+            if distinct >= batch_size:
+                yield _enrich_batch(snapshot_date, batch, market_lookup)
+                batch = []
+                distinct = 0
+            distinct += 1
+        batch.append(row)
+    if batch:
+        yield _enrich_batch(snapshot_date, batch, market_lookup)
+
+
+def _enrich_batch(snapshot_date: str, batch: list, market_lookup) -> list[dict]:
+    coin_ids = sorted({coin.coin_id for coin in batch})
+    markets = market_lookup(coin_ids) or {}
+    return [_snapshot_row(snapshot_date, coin, markets.get(coin.coin_id) or {}) for coin in batch]
+
+
+class _ParquetSink:
+    """Parquet writer flushing one row group per batch; no-op (with a warning) when pyarrow is unavailable."""
+
+    def __init__(self, path: Path):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            logger.warning("pyarrow is not installed; skipping snapshot.parquet")
+            self.writer = None
+            return
+        self.pa = pa
+        self.schema = pa.schema([
+            (name, pa.float64() if kind == 'float' else pa.string()) for name, kind in SNAPSHOT_COLUMNS
+        ])
+        self.writer = pq.ParquetWriter(str(path), self.schema, compression='zstd')
+
+    def write(self, rows: list[dict]) -> None:
+        if self.writer is None:
+            return
+        columns = {name: [r[name] for r in rows] for name in COLUMN_NAMES}
+        self.writer.write_table(self.pa.table(columns, schema=self.schema))
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+
+
+def write_snapshot(out_dir: Path, snapshot_date: str, market_lookup=fetch_market_batch) -> dict:
+    """Stream one snapshot into out_dir; return per-file stats."""
+    row_count = 0
+    value_total = 0.0
+    without_price = 0
+    parquet = _ParquetSink(out_dir / 'snapshot.parquet')
+    with gzip.open(out_dir / 'snapshot.csv.gz', 'wt', encoding='utf-8', newline='') as csv_file, \
+            gzip.open(out_dir / 'snapshot.jsonl.gz', 'wt', encoding='utf-8') as jsonl_file:
+        writer = csv.DictWriter(csv_file, fieldnames=COLUMN_NAMES)
+        writer.writeheader()
+        for rows in iter_snapshot_batches(snapshot_date, market_lookup):
+            writer.writerows(rows)
+            for row in rows:
+                jsonl_file.write(json.dumps(row, ensure_ascii=False, separators=(',', ':')))
+                jsonl_file.write('\n')
+                value_total += row['value_usd'] or 0.0
+                without_price += row['price'] is None
+            parquet.write(rows)
+            row_count += len(rows)
+    parquet.close()
+    files = sorted(p.name for p in out_dir.iterdir())
+    return {
+        'rows': row_count,
+        'rows_without_price': without_price,
+        'value_usd': value_total,
+        'parquet': parquet.writer is not None,
+        'files': files,
+    }
+
+
+def _iter_jsonl(path: Path):
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def write_diff(previous: Path, current: Path, out_path: Path) -> dict:
+    """Merge-join two sorted snapshot.jsonl.gz files into a diff of added/removed/changed rows.
+
+    Changed rows only list the fields that differ, as [old, new].
+    """
+    summary = {'added': 0, 'removed': 0, 'changed': 0, 'unchanged': 0}
+    key_of = lambda row: tuple(row.get(k) or '' for k in KEY_COLUMNS)
+    old_iter, new_iter = _iter_jsonl(previous), _iter_jsonl(current)
+    old, new = next(old_iter, None), next(new_iter, None)
+    with gzip.open(out_path, 'wt', encoding='utf-8') as out:
+        def emit(record):
+            out.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')))
+            out.write('\n')
+
+        while old is not None or new is not None:
+            if new is None or (old is not None and key_of(old) < key_of(new)):
+                emit({'op': 'removed', 'coin_id': old.get('coin_id'), 'portfolio': old.get('portfolio')})
+                summary['removed'] += 1
+                old = next(old_iter, None)
+            elif old is None or key_of(new) < key_of(old):
+                emit({'op': 'added', 'coin_id': new.get('coin_id'), 'portfolio': new.get('portfolio'), 'row': new})
+                summary['added'] += 1
+                new = next(new_iter, None)
+            else:
+                changes = {
+                    name: [old.get(name), new.get(name)]
+                    for name in COLUMN_NAMES
+                    if name not in DIFF_IGNORED and old.get(name) != new.get(name)
+                }
+                if changes:
+                    emit({'op': 'changed', 'coin_id': new.get('coin_id'), 'portfolio': new.get('portfolio'), 'changes': changes})
+                    summary['changed'] += 1
+                else:
+                    summary['unchanged'] += 1
+                old, new = next(old_iter, None), next(new_iter, None)
+    return summary
+
+
+def pid_alive(pid: int) -> bool:
+    """Whether a process with this pid exists on this host."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    except OSError:
+        return False
+    return True
+
+
+def _remove_orphaned_tmp_dirs(max_age_seconds: float = 86400) -> None:
+    """Delete .tmp-<date>-<pid> build dirs left by runs that were killed mid-write."""
+    now = time.time()
+    for tmp_dir in SNAPSHOTS_DIR.glob('.tmp-*'):
+        pid = tmp_dir.name.rsplit('-', 1)[-1]
+        try:
+            orphaned = not pid.isdigit() or not pid_alive(int(pid)) or now - tmp_dir.stat().st_mtime > max_age_seconds
+        except OSError:
+            continue
+        if orphaned:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def _partition_dir(snapshot_date: str) -> Path:
+    return SNAPSHOTS_DIR / f'date={snapshot_date}'
+
+
+def _previous_partition(snapshot_date: str) -> Path | None:
+    if not SNAPSHOTS_DIR.exists():
+        return None
+    candidates = sorted(
+        p for p in SNAPSHOTS_DIR.glob('date=*')
+        if p.name[len('date='):] < snapshot_date and (p / 'snapshot.jsonl.gz').exists()
+    )
+    return candidates[-1] if candidates else None
+
+
+def generate_daily_report(snapshot_date: str | None = None, force: bool = False, market_lookup=fetch_market_batch) -> Path | None:
+    """Write the partition for snapshot_date, which must be today (UTC, the default).
+
+    Rows carry current prices, so any other date would mislabel them and corrupt
+    later diffs; ValueError is raised instead. Existing partitions are kept unless
+    force is set. Returns the partition path, or None when it already existed.
+    """
+    today = datetime.now(timezone.utc).strftime('%Y-%m-%d')
+    snapshot_date = snapshot_date or today
+    if snapshot_date != today:
+        raise ValueError(f"snapshot_date {snapshot_date} is not today ({today} UTC); past snapshots cannot be rebuilt")
+    final_dir = _partition_dir(snapshot_date)
+    if final_dir.exists() and not force:
+        return None
+    SNAPSHOTS_DIR.mkdir(parents=True, exist_ok=True)
+    _remove_orphaned_tmp_dirs()
+    # Build in a temp dir and swap in, so readers never see a half-written partition
+    tmp_dir = SNAPSHOTS_DIR / f'.tmp-{snapshot_date}-{os.getpid()}'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir()
+    try:
+        with app.app_context():
+            stats = write_snapshot(tmp_dir, snapshot_date, market_lookup)
+        manifest = {
+            'snapshot_date': snapshot_date,
+            'generated_epoch': time.time(),
+            'rows': stats['rows'],
+            # Ids CoinGecko returned nothing for (delisted or mistyped)
+            'rows_without_price': stats['rows_without_price'],
+            'value_usd': stats['value_usd'],
+            'parquet': stats['parquet'],
+            'columns': COLUMN_NAMES,
+        }
+        previous = _previous_partition(snapshot_date)
+        if previous is not None:
+            manifest['diff'] = write_diff(previous / 'snapshot.jsonl.gz', tmp_dir / 'snapshot.jsonl.gz', tmp_dir / 'diff.jsonl.gz')
+            manifest['diff']['previous_date'] = previous.name[len('date='):]
+        manifest['files'] = sorted(p.name for p in tmp_dir.iterdir()) + ['manifest.json']
+        (tmp_dir / 'manifest.json').write_text(json.dumps(manifest, ensure_ascii=False, indent=2), encoding='utf-8')
+        if final_dir.exists():
+            shutil.rmtree(final_dir)
+        os.replace(tmp_dir, final_dir)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return final_dir
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Write today's (UTC) portfolio snapshot report.")
+    parser.add_argument('--force', action='store_true', help='rewrite the partition if it already exists')
+    args = parser.parse_args()
+    path = generate_daily_report(force=args.force)
+    if path is None:
+        print("Report already exists; use --force to rewrite.")
+    else:
+        print(f"Report written to {path}")
+
+
+if __name__ == "__main__":
+    main()
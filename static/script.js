@@ -26,7 +26,9 @@ function updateClock() {
 
 async function loadPrices() {
     // 使用统一的数据接口，包含 CoinGecko 字段和手动填写字段
-    var res = await fetch('/api/data');
+    var table = document.getElementById('token-table');
+    var dataUrl = (table && table.dataset.source) ? table.dataset.source : '/api/data';
+    var res = await fetch(dataUrl);
     var payload = await res.json();
     var rows = (payload && Array.isArray(payload.rows)) ? payload.rows : [];
 